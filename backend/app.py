@@ -4,240 +4,86 @@ Yggdrasil Commander - Backend API Server
 Zero-config appliance for sovereign network management.
 """
 
-import os
-import json
-import socket
+import re
 import base64
+import hashlib
 import random
-import subprocess
+import threading
+import mimetypes
+from functools import lru_cache
 from io import BytesIO
 from pathlib import Path
-from flask import Flask, jsonify, send_from_directory, request
+from flask import Flask, Response, abort, jsonify, request
 from flask_cors import CORS
 import qrcode
+from qrcode.image.pure import PyPNGImage
 import requests
-import toml
+from ygg import (
+    YGGDRASIL_CONFIG,
+    YGGDRASIL_SOCKET,
+    YggdrasilSocket,
+    cached,
+    check_yggdrasil_socket,
+    clear_cache as _clear_ygg_cache,
+    config_lock,
+    json_dumps,
+    json_loads,
+    read_yggdrasil_config,
+    reload_yggdrasil,
+    write_yggdrasil_config,
+)
 
 app = Flask(__name__, static_folder=None)
 CORS(app)
 
 # Configuration
 FRONTEND_BUILD_DIR = Path(__file__).parent.parent / 'frontend' / 'out'
-YGGDRASIL_SOCKET = os.environ.get('YGGDRASIL_SOCKET', '/var/run/yggdrasil/yggdrasil.sock')
-YGGDRASIL_CONFIG = '/etc/yggdrasil/yggdrasil.conf'
+IMMUTABLE_ASSET_PREFIX = '_next/static/'  # Next.js content-hashed assets
 PUBLIC_PEERS_URL = 'https://publicpeers.neilalexander.dev/publicnodes.json'
+PUBLIC_PEERS_CACHE_TTL = 60.0  # seconds to reuse the public peer list
+SOCKET_CACHE_TTL = 2.0  # seconds to reuse socket RPC results
 
+# Country names matching this are preferred when bootstrapping. Whole words
+# only, so 'us' doesn't match 'Russia' and 'uk' doesn't match 'Ukraine'.
+_REGION_RE = re.compile(
+    r'\b(?:us|europe|united[\s_-]+states|germany|france|uk|netherlands)\b',
+    re.IGNORECASE
+)
 
-class YggdrasilSocket:
-    """
-    Helper class for communicating with Yggdrasil admin socket via JSON-RPC.
-    """
-    
-    def __init__(self, socket_path=YGGDRASIL_SOCKET):
-        self.socket_path = socket_path
-    
-    def send_command(self, method, params=None):
-        """
-        Send a JSON-RPC request to the Yggdrasil admin socket.
-        
-        Args:
-            method (str): The RPC method to call (e.g., 'getSelf', 'getPeers')
-            params (dict): Optional parameters for the method
-        
-        Returns:
-            dict: The JSON-RPC response
-        
-        Raises:
-            ConnectionError: If unable to connect to the socket
-            ValueError: If the response is invalid JSON
-        """
-        if not os.path.exists(self.socket_path):
-            raise ConnectionError(f"Yggdrasil socket not found at {self.socket_path}")
-        
-        # Construct JSON-RPC request
-        request_obj = {
-            "jsonrpc": "2.0",
-            "id": 1,
-            "method": method
-        }
-        if params:
-            request_obj["params"] = params
-        
-        request_json = json.dumps(request_obj)
-        
-        try:
-            # Connect to Unix socket
-            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-            sock.settimeout(5)  # 5 second timeout
-            sock.connect(self.socket_path)
-            
-            # Send request
-            sock.sendall(request_json.encode('utf-8'))
-            sock.sendall(b'\n')  # Yggdrasil expects newline-delimited JSON
-            
-            # Receive response
-            response_data = b''
-            while True:
-                chunk = sock.recv(4096)
-                if not chunk:
-                    break
-                response_data += chunk
-                # Check if we have a complete JSON object
-                try:
-                    json.loads(response_data.decode('utf-8'))
-                    break
-                except json.JSONDecodeError:
-                    continue
-            
-            sock.close()
-            
-            # Parse response
-            response = json.loads(response_data.decode('utf-8'))
-            
-            # Check for JSON-RPC errors
-            if 'error' in response:
-                raise ValueError(f"RPC Error: {response['error']}")
-            
-            return response.get('result', response)
-        
-        except socket.timeout:
-            raise ConnectionError(f"Timeout connecting to {self.socket_path}")
-        except socket.error as e:
-            raise ConnectionError(f"Socket error: {e}")
-        except Exception as e:
-            raise RuntimeError(f"Unexpected error: {e}")
+# Shared HTTP session so repeated fetches reuse the pooled TLS connection
+_session = requests.Session()
 
 
-def check_yggdrasil_socket():
-    """Check if the Yggdrasil admin socket is accessible."""
-    try:
-        return os.path.exists(YGGDRASIL_SOCKET)
-    except Exception:
-        return False
+# =============================================================================
+# CACHING
+# =============================================================================
 
+# node address -> (peering string, QR code data URL)
+_invite_cache = {}
+_invite_lock = threading.Lock()
 
-def reload_yggdrasil():
-    """
-    Reload Yggdrasil configuration by sending SIGHUP to the process.
-    
-    Returns:
-        bool: True if successful, False otherwise
-    """
-    try:
-        # Get Yggdrasil PID
-        result = subprocess.run(
-            ['pidof', 'yggdrasil'],
-            capture_output=True,
-            text=True,
-            timeout=5
-        )
-        
-        if result.returncode != 0 or not result.stdout.strip():
-            # Try alternative method: ps + grep
-            result = subprocess.run(
-                ['ps', 'aux'],
-                capture_output=True,
-                text=True,
-                timeout=5
-            )
-            for line in result.stdout.split('\n'):
-                if 'yggdrasil' in line.lower() and 'grep' not in line:
-                    pid = line.split()[1]
-                    subprocess.run(['kill', '-HUP', pid], timeout=5)
-                    return True
-            return False
-        
-        pid = result.stdout.strip().split()[0]
-        subprocess.run(['kill', '-HUP', pid], timeout=5)
-        return True
-    
-    except subprocess.TimeoutExpired:
-        return False
-    except Exception as e:
-        print(f"Error reloading Yggdrasil: {e}")
-        return False
 
-
-def read_yggdrasil_config():
-    """
-    Read Yggdrasil configuration file.
-    
-    Returns:
-        dict: Configuration object
-    """
-    try:
-        with open(YGGDRASIL_CONFIG, 'r') as f:
-            # Yggdrasil uses HJSON, which is mostly compatible with TOML
-            # For robustness, try multiple parsers
-            content = f.read()
-            
-            # Try parsing as JSON first (if it's valid JSON)
-            try:
-                return json.loads(content)
-            except json.JSONDecodeError:
-                pass
-            
-            # Try TOML parser
-            try:
-                return toml.loads(content)
-            except:
-                pass
-            
-            # Fallback: create a minimal config structure
-            return {
-                'Peers': [],
-                'TunnelRouting': {
-                    'Enable': False,
-                    'IPv6Sources': [],
-                    'IPv6Destinations': [],
-                    'IPv4Sources': [],
-                    'IPv4Destinations': []
-                }
-            }
-    
-    except FileNotFoundError:
-        # Create mock config for testing/development
-        return {
-            'Peers': [],
-            'TunnelRouting': {
-                'Enable': False,
-                'IPv6Sources': [],
-                'IPv6Destinations': [],
-                'IPv4Sources': [],
-                'IPv4Destinations': []
-            }
-        }
-
-
-def write_yggdrasil_config(config):
-    """
-    Write Yggdrasil configuration file.
-    
-    Args:
-        config (dict): Configuration object
-    
-    Returns:
-        bool: True if successful, False otherwise
-    """
-    try:
-        # Ensure parent directory exists
-        os.makedirs(os.path.dirname(YGGDRASIL_CONFIG), exist_ok=True)
-        
-        # Write as JSON (Yggdrasil accepts JSON)
-        with open(YGGDRASIL_CONFIG, 'w') as f:
-            json.dump(config, f, indent=2)
-        
-        return True
-    
-    except Exception as e:
-        print(f"Error writing config: {e}")
-        return False
+def clear_cache():
+    """Drop all cached socket results, parsed configs and invite QR codes."""
+    _clear_ygg_cache()
+    with _invite_lock:
+        _invite_cache.clear()
 
 
 # =============================================================================
 # API ENDPOINTS
 # =============================================================================
 
+def json_response(obj, status=200):
+    """
+    Build a JSON response using the fast JSON encoder.
+    
+    Equivalent to jsonify() for plain dicts and lists, but serializes with
+    orjson when available instead of the standard library.
+    """
+    return Response(json_dumps(obj), status=status, mimetype='application/json')
+
+
 @app.route('/api/status')
 def api_status():
     """
@@ -245,15 +91,11 @@ def api_status():
     """
     socket_exists = check_yggdrasil_socket()
     
-    # Try to ping Yggdrasil socket
+    # Check that Yggdrasil is accepting connections on the socket
     socket_responsive = False
     if socket_exists:
-        try:
-            ygg = YggdrasilSocket()
-            ygg.send_command('getSelf')
-            socket_responsive = True
-        except:
-            pass
+        ygg = YggdrasilSocket()
+        socket_responsive = cached('status', SOCKET_CACHE_TTL, ygg.probe)
     
     return jsonify({
         'status': 'ok',
@@ -265,6 +107,16 @@ def api_status():
     })
 
 
+def _node_info(result):
+    """Extract the fields the frontend shows from a getSelf result."""
+    return {
+        'address': result.get('address', 'N/A'),
+        'key': result.get('key', 'N/A'),
+        'coords': result.get('coords', 'N/A'),
+        'subnet': result.get('subnet', 'N/A')
+    }
+
+
 @app.route('/api/self')
 def api_self():
     """
@@ -275,15 +127,10 @@ def api_self():
     """
     try:
         ygg = YggdrasilSocket()
-        result = ygg.send_command('getSelf')
+        result = cached('self', SOCKET_CACHE_TTL, lambda: ygg.send_command('getSelf'))
         
         # Extract clean data
-        return jsonify({
-            'address': result.get('address', 'N/A'),
-            'key': result.get('key', 'N/A'),
-            'coords': result.get('coords', 'N/A'),
-            'subnet': result.get('subnet', 'N/A')
-        })
+        return json_response(_node_info(result))
     
     except ConnectionError as e:
         return jsonify({'error': str(e)}), 503
@@ -301,9 +148,10 @@ def api_peers():
     """
     try:
         ygg = YggdrasilSocket()
-        result = ygg.send_command('getPeers')
+        result = cached('peers', SOCKET_CACHE_TTL, lambda: ygg.send_command('getPeers'))
         
-        return jsonify({
+        # The peer list can be large; serialize it with the fast encoder
+        return json_response({
             'peers': result.get('peers', [])
         })
     
@@ -313,6 +161,64 @@ def api_peers():
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
 
 
+def _build_invite(ipv6_address):
+    """
+    Render the peering string and QR code for an address.
+    
+    Returns:
+        tuple: (peering string, QR code as a base64 PNG data URL)
+    """
+    # Construct peering string (assume port 9001 for TCP)
+    peering_string = f"tcp://[{ipv6_address}]:9001"
+    
+    # Generate QR code with the pure-Python PNG writer (PIL's encoder is the
+    # slowest part of rendering a QR code this small)
+    img = qrcode.make(
+        peering_string,
+        image_factory=PyPNGImage,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    
+    # Convert to base64 (getbuffer avoids copying the PNG bytes; base64
+    # output is plain ASCII)
+    buffered = BytesIO()
+    img.save(buffered)
+    img_base64 = base64.b64encode(buffered.getbuffer()).decode('ascii')
+    
+    return peering_string, f'data:image/png;base64,{img_base64}'
+
+
+@app.route('/api/summary')
+def api_summary():
+    """
+    Get node information and connected peers in a single request.
+    
+    The dashboard polls this instead of /api/self and /api/peers. Both RPCs
+    are pipelined over one socket connection.
+    
+    Returns:
+        JSON with node info, list of peers and socket status
+    """
+    try:
+        ygg = YggdrasilSocket()
+        self_result, peers_result = cached(
+            'summary', SOCKET_CACHE_TTL, lambda: ygg.send_batch(['getSelf', 'getPeers'])
+        )
+        
+        return json_response({
+            'self': _node_info(self_result),
+            'peers': peers_result.get('peers', []),
+            'socket_responsive': True
+        })
+    
+    except ConnectionError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
+
+
 @app.route('/api/invite')
 def api_invite():
     """
@@ -325,34 +231,23 @@ def api_invite():
     """
     try:
         ygg = YggdrasilSocket()
-        result = ygg.send_command('getSelf')
+        result = cached('self', SOCKET_CACHE_TTL, lambda: ygg.send_command('getSelf'))
         
         ipv6_address = result.get('address', '')
         if not ipv6_address:
             return jsonify({'error': 'Could not retrieve IPv6 address'}), 500
         
-        # Construct peering string (assume port 9001 for TCP)
-        peering_string = f"tcp://[{ipv6_address}]:9001"
-        
-        # Generate QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(peering_string)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Convert to base64
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        # The address is stable for the node's lifetime, so the QR code
+        # only needs to be rendered once
+        invite = _invite_cache.get(ipv6_address)
+        if invite is None:
+            invite = _build_invite(ipv6_address)
+            with _invite_lock:
+                _invite_cache[ipv6_address] = invite
+        peering_string, qr_code = invite
         
         return jsonify({
-            'qr_code': f'data:image/png;base64,{img_base64}',
+            'qr_code': qr_code,
             'peering_string': peering_string,
             'address': ipv6_address
         })
@@ -363,6 +258,74 @@ def api_invite():
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
 
 
+def fetch_public_peers():
+    """
+    Fetch the public peer list, reusing it for PUBLIC_PEERS_CACHE_TTL seconds.
+    
+    Returns:
+        dict: Mapping of country to list of peer URIs
+    
+    Raises:
+        requests.RequestException: If the list cannot be fetched
+    """
+    def fetch():
+        response = _session.get(PUBLIC_PEERS_URL, timeout=10)
+        response.raise_for_status()
+        return json_loads(response.content)
+    
+    return cached('public_peers', PUBLIC_PEERS_CACHE_TTL, fetch)
+
+
+class _Reservoir:
+    """Uniform random sample of up to size items from a stream (Algorithm R)."""
+    
+    def __init__(self, size):
+        self.size = size
+        self.items = []
+        self.seen = 0
+    
+    def offer(self, item):
+        if self.seen < self.size:
+            self.items.append(item)
+        else:
+            j = random.randint(0, self.seen)
+            if j < self.size:
+                self.items[j] = item
+        self.seen += 1
+
+
+def sample_bootstrap_peers(peer_data, existing_peers, count):
+    """
+    Randomly pick new peers from the public peer list in a single pass.
+    
+    Peers from preferred regions are chosen if there are any, otherwise peers
+    from anywhere. Already configured peers are skipped so they don't take up
+    a slot.
+    
+    Args:
+        peer_data (dict): Country name -> list of peer URIs
+        existing_peers (Container): Peer URIs already in the config
+        count (int): Maximum number of peers to pick
+    
+    Returns:
+        list: Selected peer URIs
+    """
+    regional = _Reservoir(count)
+    other = _Reservoir(count)
+    # Every peer offered so far; checking only the current sample would let
+    # an evicted duplicate be offered again and skew the odds
+    offered = set()
+    
+    for country, peers in peer_data.items():
+        reservoir = regional if _REGION_RE.search(country) else other
+        for peer in peers:
+            if isinstance(peer, str) and peer not in existing_peers and peer not in offered:
+                offered.add(peer)
+                reservoir.offer(peer)
+    
+    return regional.items or other.items
+
+
 @app.route('/api/bootstrap', methods=['POST'])
 def api_bootstrap():
     """
@@ -379,60 +342,34 @@ def api_bootstrap():
     """
     try:
         # Step A: Fetch public peer list
-        response = requests.get(PUBLIC_PEERS_URL, timeout=10)
-        response.raise_for_status()
-        peer_data = response.json()
-        
-        # Step B: Select peers from US or Europe
-        preferred_regions = ['us', 'europe', 'united states', 'germany', 'france', 'uk', 'netherlands']
-        selected_peers = []
-        
-        # Flatten peer list and filter by region
-        available_peers = []
-        for country, peers in peer_data.items():
-            country_lower = country.lower()
-            if any(region in country_lower for region in preferred_regions):
-                for peer in peers:
-                    if isinstance(peer, str):
-                        available_peers.append(peer)
+        peer_data = fetch_public_peers()
         
-        # If no regional peers found, use any available
-        if not available_peers:
-            for country, peers in peer_data.items():
-                for peer in peers:
-                    if isinstance(peer, str):
-                        available_peers.append(peer)
-        
-        # Randomly select 3 peers
-        if len(available_peers) >= 3:
-            selected_peers = random.sample(available_peers, 3)
-        elif available_peers:
-            selected_peers = available_peers
-        else:
-            return jsonify({'error': 'No public peers available'}), 500
-        
-        # Step C: Read current config
-        config = read_yggdrasil_config()
-        
-        # Ensure Peers list exists
-        if 'Peers' not in config:
-            config['Peers'] = []
-        
-        # Step D: Append new peers (avoid duplicates)
-        existing_peers = set(config['Peers'])
-        peers_added = []
-        
-        for peer in selected_peers:
-            if peer not in existing_peers:
-                config['Peers'].append(peer)
-                peers_added.append(peer)
-        
-        # Step E: Write config back
-        if not write_yggdrasil_config(config):
-            return jsonify({'error': 'Failed to write configuration'}), 500
-        
-        # Step F: Reload Yggdrasil
-        reload_success = reload_yggdrasil()
+        # Read, modify and write the config as one step so concurrent
+        # requests (in any worker) don't overwrite each other's changes
+        with config_lock():
+            # Step B: Read current config
+            config = read_yggdrasil_config()
+            
+            # Existing peers as an ordered set: keeps config order, O(1) lookups
+            merged_peers = dict.fromkeys(config.get('Peers', []))
+            
+            # Step C: Randomly select 3 new peers, preferring US or Europe
+            selected_peers = sample_bootstrap_peers(peer_data, merged_peers, 3)
+            if not selected_peers:
+                return jsonify({'error': 'No public peers available'}), 500
+            
+            # Step D: Append new peers (avoid duplicates)
+            peers_added = [peer for peer in dict.fromkeys(selected_peers) if peer not in merged_peers]
+            merged_peers.update(dict.fromkeys(peers_added))
+            config['Peers'] = list(merged_peers)
+            
+            # Step E: Write config back
+            write_result = write_yggdrasil_config(config)
+            if not write_result:
+                return jsonify({'error': 'Failed to write configuration'}), 500
+            
+        # Step F: Reload Yggdrasil (nothing to reload if the file is unchanged)
+        reload_success = reload_yggdrasil() if write_result == 'written' else True
         
         return jsonify({
             'status': 'bootstrapped',
@@ -470,56 +407,58 @@ def api_exit_node():
         data = request.get_json()
         enabled = data.get('enabled', False)
         
-        # Read current config
-        config = read_yggdrasil_config()
-        
-        # Ensure TunnelRouting structure exists
-        if 'TunnelRouting' not in config:
-            config['TunnelRouting'] = {
-                'Enable': False,
-                'IPv6Sources': [],
-                'IPv6Destinations': [],
-                'IPv4Sources': [],
-                'IPv4Destinations': []
-            }
-        
-        tunnel_routing = config['TunnelRouting']
-        
-        # Ensure IPv6Destinations exists
-        if 'IPv6Destinations' not in tunnel_routing:
-            tunnel_routing['IPv6Destinations'] = []
-        
-        if enabled:
-            # Enable exit node
-            tunnel_routing['Enable'] = True
+        with config_lock():
+            # Read current config
+            config = read_yggdrasil_config()
             
-            # Add ::/0 to advertised routes (if not already present)
-            if '::/0' not in tunnel_routing['IPv6Destinations']:
-                tunnel_routing['IPv6Destinations'].append('::/0')
-        
-        else:
-            # Disable exit node
-            # Remove ::/0 from advertised routes
-            if '::/0' in tunnel_routing['IPv6Destinations']:
-                tunnel_routing['IPv6Destinations'].remove('::/0')
+            # Ensure TunnelRouting structure exists
+            if 'TunnelRouting' not in config:
+                config['TunnelRouting'] = {
+                    'Enable': False,
+                    'IPv6Sources': [],
+                    'IPv6Destinations': [],
+                    'IPv4Sources': [],
+                    'IPv4Destinations': []
+                }
             
-            # Disable TunnelRouting if no other routes
-            has_routes = (
-                tunnel_routing.get('IPv6Destinations', []) or
-                tunnel_routing.get('IPv6Sources', []) or
-                tunnel_routing.get('IPv4Destinations', []) or
-                tunnel_routing.get('IPv4Sources', [])
-            )
+            tunnel_routing = config['TunnelRouting']
             
-            if not has_routes:
-                tunnel_routing['Enable'] = False
-        
-        # Write config back
-        if not write_yggdrasil_config(config):
-            return jsonify({'error': 'Failed to write configuration'}), 500
-        
-        # Reload Yggdrasil
-        reload_success = reload_yggdrasil()
+            # Ensure IPv6Destinations exists
+            if 'IPv6Destinations' not in tunnel_routing:
+                tunnel_routing['IPv6Destinations'] = []
+            
+            if enabled:
+                # Enable exit node
+                tunnel_routing['Enable'] = True
+                
+                # Add ::/0 to advertised routes (if not already present)
+                if '::/0' not in tunnel_routing['IPv6Destinations']:
+                    tunnel_routing['IPv6Destinations'].append('::/0')
+            
+            else:
+                # Disable exit node
+                # Remove ::/0 from advertised routes
+                if '::/0' in tunnel_routing['IPv6Destinations']:
+                    tunnel_routing['IPv6Destinations'].remove('::/0')
+                
+                # Disable TunnelRouting if no other routes
+                has_routes = (
+                    tunnel_routing.get('IPv6Destinations', []) or
+                    tunnel_routing.get('IPv6Sources', []) or
+                    tunnel_routing.get('IPv4Destinations', []) or
+                    tunnel_routing.get('IPv4Sources', [])
+                )
+                
+                if not has_routes:
+                    tunnel_routing['Enable'] = False
+            
+            # Write config back
+            write_result = write_yggdrasil_config(config)
+            if not write_result:
+                return jsonify({'error': 'Failed to write configuration'}), 500
+            
+        # Reload Yggdrasil (nothing to reload if the file is unchanged)
+        reload_success = reload_yggdrasil() if write_result == 'written' else True
         
         return jsonify({
             'status': 'exit_node_updated',
@@ -536,20 +475,85 @@ def api_exit_node():
 # STATIC FILE SERVING (Next.js Frontend)
 # =============================================================================
 
+def build_static_index(root):
+    """
+    Map every servable URL path under root to its file.
+    
+    Files are reachable by their relative path; HTML pages are also
+    reachable without the '.html' suffix, matching Next.js export routes.
+    
+    Args:
+        root (Path): Frontend build directory
+    
+    Returns:
+        dict: URL path -> absolute Path
+    """
+    index = {}
+    if not root.is_dir():
+        return index
+    
+    for file_path in root.rglob('*'):
+        if not file_path.is_file():
+            continue
+        rel_path = file_path.relative_to(root).as_posix()
+        index[rel_path] = file_path
+        if rel_path.endswith('.html'):
+            # A real file with the bare name takes precedence
+            index.setdefault(rel_path[:-len('.html')], file_path)
+    
+    return index
+
+
+# Built once at startup; the frontend is a static export
+_static_index = build_static_index(FRONTEND_BUILD_DIR)
+
+
+@lru_cache(maxsize=128)
+def _load_static_file(file_path):
+    """
+    Read a static file once and keep it in memory with its metadata.
+    
+    Returns:
+        tuple: (bytes, MIME type, ETag, modification time)
+    """
+    mimetype = mimetypes.guess_type(file_path.name)[0] or 'application/octet-stream'
+    mtime = file_path.stat().st_mtime
+    data = file_path.read_bytes()
+    return data, mimetype, hashlib.sha1(data).hexdigest(), mtime
+
+
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve_frontend(path):
     """
     Serve the Next.js static build.
     Handles both direct file requests and client-side routing.
+    
+    Content-hashed assets under _next/static/ are marked immutable so
+    browsers never re-request them. Everything else is served no-cache
+    with an ETag and Last-Modified, so revalidation gets a 304.
     """
-    if path and (FRONTEND_BUILD_DIR / path).exists():
-        return send_from_directory(FRONTEND_BUILD_DIR, path)
-    elif path and (FRONTEND_BUILD_DIR / f'{path}.html').exists():
-        return send_from_directory(FRONTEND_BUILD_DIR, f'{path}.html')
-    else:
+    file_path = _static_index.get(path)
+    if file_path is None:
         # Fallback to index.html for client-side routing
-        return send_from_directory(FRONTEND_BUILD_DIR, 'index.html')
+        file_path = _static_index.get('index.html')
+        if file_path is None:
+            abort(404)
+    
+    data, mimetype, etag, mtime = _load_static_file(file_path)
+    response = Response(data, mimetype=mimetype)
+    response.set_etag(etag)
+    response.last_modified = mtime
+    
+    if path in _static_index and path.startswith(IMMUTABLE_ASSET_PREFIX):
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    
+    # Answer If-None-Match/If-Modified-Since with 304 and Range with 206
+    return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
 
 
 if __name__ == '__main__':
@@ -565,5 +569,5 @@ if __name__ == '__main__':
     print(f"🌐 Starting on http://0.0.0.0:5000")
     
     # Run the Flask development server
-    # In production, use a WSGI server like Gunicorn
+    # In production, serve wsgi:app with Gunicorn (see wsgi.py)
     app.run(host='0.0.0.0', port=5000, debug=False)
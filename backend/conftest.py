@@ -0,0 +1,40 @@
+"""
+Shared pytest configuration for the backend tests.
+
+qrcode imports Pillow whenever it is installed, which makes it the slowest
+import in the suite. The tests never render a real QR code (the invite
+tests patch qrcode.make), so a lightweight stub is registered before app
+is imported.
+
+app itself is then imported here, during conftest loading, so each xdist
+worker pays for importing Flask and requests once, before collection.
+"""
+
+import sys
+import types
+from unittest.mock import MagicMock
+import pytest
+
+if 'qrcode' not in sys.modules:
+    _qrcode = types.ModuleType('qrcode')
+    _qrcode.make = MagicMock()
+    _qrcode.constants = types.SimpleNamespace(ERROR_CORRECT_L=1)
+    _qrcode_image = types.ModuleType('qrcode.image')
+    _qrcode_pure = types.ModuleType('qrcode.image.pure')
+    _qrcode_pure.PyPNGImage = MagicMock()
+    _qrcode.image = _qrcode_image
+    _qrcode_image.pure = _qrcode_pure
+
+    sys.modules.update({
+        'qrcode': _qrcode,
+        'qrcode.image': _qrcode_image,
+        'qrcode.image.pure': _qrcode_pure,
+    })
+
+import app  # noqa: E402 (must come after the qrcode stub)
+
+
+@pytest.fixture(scope='session', autouse=True)
+def _warm_app():
+    """Compile the URL map once per worker, before the first test request."""
+    app.app.url_map.update()
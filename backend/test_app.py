@@ -1,308 +1,964 @@
 #!/usr/bin/env python3
 """
 Test suite for Yggdrasil Commander backend.
-Run with: python -m pytest test_app.py -v
+Run with: python -m pytest test_app.py -v (tests run in parallel, see pytest.ini)
 """
 
+import io
+import os
+import sys
 import json
-import tempfile
-from unittest.mock import Mock, patch, MagicMock
-from app import (
+import fcntl
+import signal
+import socket
+import importlib.util
+import threading
+from types import SimpleNamespace
+from unittest.mock import Mock, patch, MagicMock, mock_open
+import pytest
+import app as app_module
+import ygg
+from ygg import (
     YggdrasilSocket,
     check_yggdrasil_socket,
+    config_lock,
     read_yggdrasil_config,
     write_yggdrasil_config,
-    reload_yggdrasil,
+    reload_yggdrasil
+)
+from app import (
+    clear_cache,
+    build_static_index,
+    sample_bootstrap_peers,
     app
 )
 
 
-class TestYggdrasilSocket:
-    """Test the YggdrasilSocket class."""
-    
-    def test_socket_not_found(self):
-        """Test behavior when socket doesn't exist."""
-        ygg = YggdrasilSocket('/nonexistent/socket.sock')
-        try:
-            ygg.send_command('getSelf')
-            assert False, "Should raise ConnectionError"
-        except ConnectionError as e:
-            assert 'not found' in str(e)
-    
-    @patch('socket.socket')
-    def test_send_command_success(self, mock_socket_class):
-        """Test successful command execution."""
-        # Mock socket
-        mock_sock = MagicMock()
-        mock_socket_class.return_value = mock_sock
-        
-        # Mock response
-        response = {
-            "jsonrpc": "2.0",
-            "id": 1,
-            "result": {
-                "address": "200:1234::1",
-                "key": "abc123",
-                "coords": "[1 2 3]"
-            }
-        }
-        mock_sock.recv.return_value = json.dumps(response).encode('utf-8')
-        
-        # Create temporary socket file for testing
-        with tempfile.NamedTemporaryFile() as tmp:
-            ygg = YggdrasilSocket(tmp.name)
-            
-            with patch('os.path.exists', return_value=True):
-                result = ygg.send_command('getSelf')
-                assert result['address'] == "200:1234::1"
-    
-    @patch('socket.socket')
-    def test_send_command_with_params(self, mock_socket_class):
-        """Test command with parameters."""
-        mock_sock = MagicMock()
-        mock_socket_class.return_value = mock_sock
-        
-        response = {"jsonrpc": "2.0", "id": 1, "result": {}}
-        mock_sock.recv.return_value = json.dumps(response).encode('utf-8')
-        
-        with tempfile.NamedTemporaryFile() as tmp:
-            ygg = YggdrasilSocket(tmp.name)
-            
-            with patch('os.path.exists', return_value=True):
-                ygg.send_command('addPeer', {'uri': 'tcp://example.com:9001'})
-                
-                # Verify request was sent with params
-                call_args = mock_sock.sendall.call_args_list[0][0][0]
-                request = json.loads(call_args.decode('utf-8'))
-                assert 'params' in request
-
-
-class TestConfigManagement:
-    """Test configuration file read/write operations."""
-    
-    def test_read_nonexistent_config(self):
-        """Test reading config when file doesn't exist."""
-        with patch('builtins.open', side_effect=FileNotFoundError):
-            config = read_yggdrasil_config()
-            assert 'Peers' in config
-            assert 'TunnelRouting' in config
-    
-    def test_read_json_config(self):
-        """Test reading valid JSON config."""
-        test_config = {
-            'Peers': ['tcp://peer1:9001'],
-            'TunnelRouting': {'Enable': False}
+# Peering string /api/invite builds for the address in self_response
+EXPECTED_PEER = 'tcp://[200:1234::1]:9001'
+
+
+@pytest.fixture(scope='session')
+def canned_self_bytes():
+    """Encoded getSelf reply from the admin socket, built once per worker."""
+    return json.dumps({
+        "jsonrpc": "2.0",
+        "id": 1,
+        "result": {
+            "address": "200:1234::1",
+            "key": "abc123",
+            "coords": "[1 2 3]"
         }
+    }).encode('utf-8') + b'\n'
+
+
+@pytest.fixture(scope='session')
+def self_response():
+    """getSelf result returned by the mocked admin socket."""
+    return {
+        'address': '200:1234::1',
+        'key': 'testkey123',
+        'coords': '[1 2 3]',
+        'subnet': '300:1234::/64'
+    }
+
+
+class FakePeersResponse:
+    """Minimal stand-in for the requests.Response of the public peers fetch."""
+    
+    def __init__(self, peers):
+        self.content = json.dumps(peers).encode('utf-8')
+    
+    def raise_for_status(self):
+        pass
+
+
+class FakeAdminSocket:
+    """
+    Stand-in for a connection to the Yggdrasil admin socket.
+    
+    Like Yggdrasil, it closes the connection after replying to a request
+    that doesn't ask for keepalive. With honour_keepalive=False it closes
+    after the first reply regardless, like a daemon that ignores the flag.
+    Each reply's result is taken from results by method name, defaulting to
+    {'method': <name>}.
+    """
+    
+    def __init__(self, honour_keepalive=True, results=None):
+        self.honour_keepalive = honour_keepalive
+        self.results = results or {}
+        self.requests = []
+        self.pending = []
+        self.peer_closed = False
+    
+    def setsockopt(self, *args):
+        pass
+    
+    def settimeout(self, timeout):
+        pass
+    
+    def connect(self, path):
+        pass
+    
+    def close(self):
+        pass
+    
+    def sendall(self, data):
+        if self.peer_closed:
+            return
+        for line in data.splitlines():
+            request = json.loads(line)
+            self.requests.append(request)
+            self.pending.append(request)
+    
+    def recv(self, size):
+        if self.peer_closed or not self.pending:
+            return b''
+        request = self.pending.pop(0)
+        if not (self.honour_keepalive and request.get('keepalive')):
+            self.peer_closed = True
+        result = self.results.get(request['method'], {"method": request['method']})
+        reply = {"jsonrpc": "2.0", "id": request['id'], "result": result}
+        return json.dumps(reply, indent=2).encode('utf-8') + b'\n'
+
+
+def _fake_connections(mock_socket_class, **kwargs):
+    """Make socket.socket hand out FakeAdminSockets; returns the list of them."""
+    connections = []
+    
+    def new_socket(*args):
+        connections.append(FakeAdminSocket(**kwargs))
+        return connections[-1]
+    
+    mock_socket_class.side_effect = new_socket
+    return connections
+
+
+@pytest.fixture
+def ygg_mocks(monkeypatch, config_path):
+    """
+    Replace config I/O, the Yggdrasil reload and the public peers fetch.
+    
+    The config path still points at a temporary directory, which is where
+    config_lock() creates its lock file.
+    """
+    mocks = SimpleNamespace(
+        read=MagicMock(),
+        write=MagicMock(return_value='written'),
+        reload=MagicMock(return_value=True),
+        requests_get=MagicMock()
+    )
+    monkeypatch.setattr(app_module, 'read_yggdrasil_config', mocks.read)
+    monkeypatch.setattr(app_module, 'write_yggdrasil_config', mocks.write)
+    monkeypatch.setattr(app_module, 'reload_yggdrasil', mocks.reload)
+    monkeypatch.setattr(app_module._session, 'get', mocks.requests_get)
+    return mocks
+
+
+@pytest.fixture
+def mock_socket_class(monkeypatch):
+    """Replace socket.socket so no real admin socket is opened."""
+    mock_class = MagicMock()
+    monkeypatch.setattr(socket, 'socket', mock_class)
+    return mock_class
+
+
+@pytest.fixture
+def config_path(tmp_path, monkeypatch):
+    """Point ygg at a config file in this test's temporary directory."""
+    path = tmp_path / 'yggdrasil.conf'
+    monkeypatch.setattr(ygg, 'YGGDRASIL_CONFIG', str(path))
+    return path
+
+
+@pytest.fixture
+def mock_ygg(monkeypatch):
+    """Replace app's YggdrasilSocket; returns the instance endpoints use."""
+    instance = MagicMock()
+    monkeypatch.setattr(app_module, 'YggdrasilSocket', MagicMock(return_value=instance))
+    return instance
+
+
+@pytest.fixture
+def mock_qr_make(monkeypatch):
+    """Replace qrcode.make so no QR code image is rendered."""
+    mock_make = MagicMock()
+    monkeypatch.setattr(app_module.qrcode, 'make', mock_make)
+    return mock_make
+
+
+@pytest.fixture(autouse=True)
+def _reset_state():
+    """Drop persistent socket connections and cached results between tests."""
+    YggdrasilSocket.close_all()
+    clear_cache()
+
+
+@pytest.fixture(scope='module')
+def client():
+    """Push one app context and share one test client across the module."""
+    app.config['TESTING'] = True
+    with app.app_context():
+        yield app.test_client()
+
+
+# =============================================================================
+# JSON HELPERS
+# =============================================================================
+
+@pytest.mark.parametrize('blocked,backend', [
+    (('orjson',), 'ujson'),
+    (('orjson', 'ujson'), 'json'),
+], ids=['ujson', 'json'])
+def test_json_fallbacks(monkeypatch, blocked, backend):
+    """Test the JSON helpers when orjson (and ujson) cannot be imported."""
+    if backend == 'ujson':
+        pytest.importorskip('ujson')
+    for name in blocked:
+        monkeypatch.setitem(sys.modules, name, None)
+    
+    # Load a private copy of ygg so the fallback branch runs
+    spec = importlib.util.spec_from_file_location('ygg_fallback', ygg.__file__)
+    fallback = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fallback)
+    assert fallback._json.__name__ == backend
+    
+    assert json.loads(fallback.json_dumps({'Peers': ['tcp://peer1:9001']})) == {
+        'Peers': ['tcp://peer1:9001']
+    }
+    assert fallback.json_dumps({'a': 1}, indent=True).startswith(b'{\n  "a"')
+    assert fallback.json_loads(memoryview(b'{"a": 1}')) == {'a': 1}
+    assert json.loads(fallback.YggdrasilSocket._encode_request('getSelf'))['method'] == 'getSelf'
+
+
+# =============================================================================
+# YGGDRASIL SOCKET
+# =============================================================================
+
+def test_socket_not_found():
+    """Test behavior when socket doesn't exist."""
+    sock = YggdrasilSocket('/nonexistent/socket.sock')
+    try:
+        sock.send_command('getSelf')
+        assert False, "Should raise ConnectionError"
+    except ConnectionError as e:
+        assert 'not found' in str(e)
+
+
+def test_send_command_success(mock_socket_class, canned_self_bytes):
+    """Test successful command execution."""
+    # Mock socket
+    mock_sock = MagicMock()
+    mock_socket_class.return_value = mock_sock
+    
+    mock_sock.recv.return_value = canned_self_bytes
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        result = sock.send_command('getSelf')
+        assert result['address'] == "200:1234::1"
+
+
+def test_send_command_with_params(mock_socket_class, canned_self_bytes):
+    """Test command with parameters."""
+    mock_sock = MagicMock()
+    mock_socket_class.return_value = mock_sock
+    
+    mock_sock.recv.return_value = canned_self_bytes
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        sock.send_command('addPeer', {'uri': 'tcp://example.com:9001'})
         
-        mock_file = MagicMock()
-        mock_file.__enter__().read.return_value = json.dumps(test_config)
-        
-        with patch('builtins.open', return_value=mock_file):
+        # Verify request was sent with params
+        call_args = mock_sock.sendall.call_args_list[0][0][0]
+        request = json.loads(call_args.decode('utf-8'))
+        assert 'params' in request
+
+
+def test_send_batch(mock_socket_class):
+    """Test pipelining several commands in one write."""
+    mock_sock = MagicMock()
+    mock_socket_class.return_value = mock_sock
+    
+    responses = [
+        {"jsonrpc": "2.0", "id": 1, "result": {"address": "200:1234::1"}},
+        {"jsonrpc": "2.0", "id": 2, "result": {"peers": []}}
+    ]
+    # Yggdrasil indents its replies, so each one spans several lines
+    mock_sock.recv.return_value = b''.join(
+        json.dumps(r, indent=2).encode('utf-8') + b'\n' for r in responses
+    )
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        self_info, peers = sock.send_batch(['getSelf', ('getPeers', {'sort': 'uptime'})])
+    
+    assert self_info['address'] == '200:1234::1'
+    assert peers == {'peers': []}
+    assert mock_sock.sendall.call_count == 1
+    
+    sent = mock_sock.sendall.call_args[0][0].splitlines()
+    assert [json.loads(line)['method'] for line in sent] == ['getSelf', 'getPeers']
+    assert json.loads(sent[1])['params'] == {'sort': 'uptime'}
+
+
+@pytest.mark.parametrize('indent', [None, 2], ids=['compact', 'indented'])
+def test_send_batch_parses_each_response_once(mock_socket_class, monkeypatch, indent):
+    """Test that pipelined replies split at arbitrary points are each parsed once."""
+    mock_sock = MagicMock()
+    mock_socket_class.return_value = mock_sock
+    
+    results = [{"address": "200:1234::1"}, {"peers": [{"remote": "tcp://a:1"}] * 20}, {}]
+    payload = b''.join(
+        json.dumps({"jsonrpc": "2.0", "id": i, "result": r}, indent=indent).encode('utf-8') + b'\n'
+        for i, r in enumerate(results, start=1)
+    )
+    mock_sock.recv.side_effect = [payload[i:i + 37] for i in range(0, len(payload), 37)]
+    
+    parse = MagicMock(side_effect=ygg.json_loads)
+    monkeypatch.setattr(ygg, 'json_loads', parse)
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        assert sock.send_batch(['getSelf', 'getPeers', 'getSessions']) == results
+    assert parse.call_count == 3
+
+
+def test_send_batch_server_closes_after_reply(mock_socket_class):
+    """Test a batch against a daemon that closes after every reply."""
+    connections = _fake_connections(mock_socket_class, honour_keepalive=False)
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        results = sock.send_batch(['getSelf', 'getPeers', 'getSessions'])
+    
+    assert results == [{'method': m} for m in ('getSelf', 'getPeers', 'getSessions')]
+    # Only the first reply arrives on the pipelined connection; the rest
+    # are sent one per connection
+    assert [r['method'] for r in connections[0].requests] == ['getSelf', 'getPeers', 'getSessions']
+    assert [[r['method'] for r in c.requests] for c in connections[1:]] == [['getPeers'], ['getSessions']]
+
+
+def test_send_batch_keepalive(mock_socket_class):
+    """Test that a batch is pipelined over one kept-alive connection."""
+    connections = _fake_connections(mock_socket_class)
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        assert sock.send_batch(['getSelf', 'getPeers']) == [{'method': 'getSelf'}, {'method': 'getPeers'}]
+        assert sock.send_command('getSelf') == {'method': 'getSelf'}
+    
+    assert len(connections) == 1
+
+
+def test_send_command_chunked_response(mock_socket_class):
+    """Test a response that arrives across several reads."""
+    mock_sock = MagicMock()
+    mock_socket_class.return_value = mock_sock
+
+    response = {"jsonrpc": "2.0", "id": 1, "result": {"peers": ["a", "b"]}}
+    payload = json.dumps(response).encode('utf-8') + b'\n'
+    mock_sock.recv.side_effect = [payload[:10], payload[10:]]
+
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        result = sock.send_command('getPeers')
+        assert result['peers'] == ["a", "b"]
+        assert mock_sock.recv.call_count == 2
+
+
+def test_send_command_multiline_response(mock_socket_class):
+    """Test an indented reply that arrives split at a line break."""
+    mock_sock = MagicMock()
+    mock_socket_class.return_value = mock_sock
+    
+    response = {"jsonrpc": "2.0", "id": 1, "result": {"address": "200:1234::1"}}
+    payload = json.dumps(response, indent=2).encode('utf-8') + b'\n'
+    split = payload.index(b'\n') + 1
+    mock_sock.recv.side_effect = [payload[:split], payload[split:]]
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        assert sock.send_command('getSelf') == {"address": "200:1234::1"}
+    assert mock_sock.recv.call_count == 2
+
+
+def test_send_command_parses_once(mock_socket_class, monkeypatch):
+    """Test that a reply arriving line by line is parsed exactly once."""
+    mock_sock = MagicMock()
+    mock_socket_class.return_value = mock_sock
+    
+    peers = [{"address": f"200:{i:x}::1", "remote": "tcp://[::1]:9001"} for i in range(50)]
+    response = {"jsonrpc": "2.0", "id": 1, "result": {"peers": peers}}
+    payload = json.dumps(response, indent=2).encode('utf-8') + b'\n'
+    mock_sock.recv.side_effect = payload.splitlines(keepends=True)
+    
+    parse = MagicMock(side_effect=ygg.json_loads)
+    monkeypatch.setattr(ygg, 'json_loads', parse)
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        assert sock.send_command('getPeers') == {"peers": peers}
+    assert parse.call_count == 1
+
+
+def test_send_command_reuses_connection(mock_socket_class):
+    """Test that consecutive commands share one connection."""
+    mock_sock = MagicMock()
+    mock_socket_class.return_value = mock_sock
+
+    response = {"jsonrpc": "2.0", "id": 1, "result": {}}
+    mock_sock.recv.return_value = json.dumps(response).encode('utf-8') + b'\n'
+
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        sock.send_command('getSelf')
+        YggdrasilSocket('/tmp/fake-ygg.sock').send_command('getPeers')
+
+    assert mock_socket_class.call_count == 1
+    assert mock_sock.connect.call_count == 1
+    assert mock_sock.sendall.call_count == 2
+
+
+def test_send_command_keepalive(mock_socket_class):
+    """Test that requests ask Yggdrasil to keep the connection open."""
+    connections = _fake_connections(mock_socket_class)
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        assert sock.send_command('getSelf') == {'method': 'getSelf'}
+        assert sock.send_command('getPeers') == {'method': 'getPeers'}
+    
+    assert len(connections) == 1
+    assert all(request['keepalive'] is True for request in connections[0].requests)
+
+
+def test_send_command_server_closes_after_reply(mock_socket_class):
+    """Test a daemon that closes the connection after every reply."""
+    connections = _fake_connections(mock_socket_class, honour_keepalive=False)
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        assert sock.send_command('getSelf') == {'method': 'getSelf'}
+        assert sock.send_command('getPeers') == {'method': 'getPeers'}
+    
+    # The dead connection is noticed and replaced
+    assert len(connections) == 2
+
+
+def test_send_command_reconnects_stale_connection(mock_socket_class):
+    """Test that a connection closed by Yggdrasil is replaced once."""
+    response = json.dumps({"jsonrpc": "2.0", "id": 1, "result": {}}).encode('utf-8') + b'\n'
+    stale_sock = MagicMock()
+    stale_sock.recv.side_effect = [response, b'']
+    fresh_sock = MagicMock()
+    fresh_sock.recv.return_value = response
+    mock_socket_class.side_effect = [stale_sock, fresh_sock]
+
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    with patch('os.path.exists', return_value=True):
+        sock.send_command('getSelf')
+        assert sock.send_command('getSelf') == {}
+
+    stale_sock.close.assert_called()
+    assert fresh_sock.sendall.call_count == 1
+
+
+def test_probe(mock_socket_class):
+    """Test the connect-only responsiveness probe."""
+    mock_sock = MagicMock()
+    mock_socket_class.return_value = mock_sock
+    
+    sock = YggdrasilSocket('/tmp/fake-ygg.sock')
+    assert sock.probe() is True
+    mock_sock.sendall.assert_not_called()
+    
+    mock_sock.connect.side_effect = ConnectionRefusedError
+    assert sock.probe() is False
+    assert mock_sock.close.call_count == 2
+
+
+# =============================================================================
+# CONFIG MANAGEMENT
+# =============================================================================
+
+def _read_config_file(config_path, content):
+    """Write content to the temporary config file and read it back."""
+    config_path.write_text(content)
+    return read_yggdrasil_config()
+
+
+def test_read_nonexistent_config(monkeypatch):
+    """Test reading config when file doesn't exist."""
+    monkeypatch.setattr(ygg, 'YGGDRASIL_CONFIG', '/nonexistent/yggdrasil.conf')
+    config = read_yggdrasil_config()
+    assert 'Peers' in config
+    assert 'TunnelRouting' in config
+
+
+def test_read_json_config(config_path):
+    """Test reading valid JSON config."""
+    test_config = {
+        'Peers': ['tcp://peer1:9001'],
+        'TunnelRouting': {'Enable': False}
+    }
+    
+    config = _read_config_file(config_path, '\n  ' + json.dumps(test_config))
+    assert config['Peers'] == ['tcp://peer1:9001']
+
+
+def test_read_toml_config(config_path):
+    """Test reading a TOML config."""
+    config = _read_config_file(config_path, 'Peers = ["tcp://peer1:9001"]\n')
+    assert config['Peers'] == ['tcp://peer1:9001']
+
+
+def test_read_empty_config(config_path):
+    """Test reading an empty config file."""
+    assert _read_config_file(config_path, '') == {}
+
+
+def test_read_invalid_config(config_path):
+    """Test that an unparseable config raises instead of being replaced."""
+    try:
+        _read_config_file(config_path, '{ Peers: [ tcp://peer1:9001 ] # HJSON }')
+        assert False, "Should raise ValueError"
+    except ValueError as e:
+        assert 'Invalid configuration' in str(e)
+
+
+def test_write_config(monkeypatch):
+    """Test writing config to file, without touching the disk."""
+    test_config = {
+        'Peers': ['tcp://peer1:9001'],
+        'TunnelRouting': {'Enable': False}
+    }
+    
+    config_path = '/etc/yggdrasil/yggdrasil.conf'
+    monkeypatch.setattr(ygg, 'YGGDRASIL_CONFIG', config_path)
+    
+    # The config is written to a unique temporary file through os.fdopen and
+    # then renamed over the original
+    tmp_name = '/etc/yggdrasil/.yggdrasil.conf.abc123'
+    m = mock_open()
+    with patch('builtins.open', side_effect=FileNotFoundError), \
+            patch.object(ygg.os, 'makedirs'), \
+            patch.object(ygg.tempfile, 'mkstemp', return_value=(3, tmp_name)) as mock_mkstemp, \
+            patch.object(ygg.os, 'fchmod') as mock_fchmod, \
+            patch.object(ygg.os, 'fdopen', m), \
+            patch.object(ygg.os, 'fsync'), \
+            patch.object(ygg.os, 'replace') as mock_replace:
+        assert write_yggdrasil_config(test_config) == 'written'
+    
+    handle = m()
+    written = b''.join(c.args[0] for c in handle.write.call_args_list)
+    assert json.loads(written)['Peers'] == ['tcp://peer1:9001']
+    mock_mkstemp.assert_called_once_with(dir='/etc/yggdrasil', prefix='.yggdrasil.conf.')
+    mock_fchmod.assert_called_once_with(3, 0o600)
+    mock_replace.assert_called_once_with(tmp_name, config_path)
+    
+    # Writing the same config again leaves the file alone
+    with patch('builtins.open', mock_open(read_data=written)):
+        assert write_yggdrasil_config(test_config) == 'unchanged'
+
+
+def test_write_config_concurrent_writers(config_path):
+    """Test that concurrent writers never leave a partial or foreign file."""
+    configs = [{'Peers': [f'tcp://peer{i}:9001'] * 200} for i in range(8)]
+    results = []
+    
+    def writer(config):
+        for _ in range(20):
+            results.append(write_yggdrasil_config(config))
+    
+    threads = [threading.Thread(target=writer, args=(c,)) for c in configs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert len(results) == 160
+    assert set(results) <= {'written', 'unchanged'}
+    assert json.loads(config_path.read_text()) in configs
+    assert os.listdir(config_path.parent) == ['yggdrasil.conf']
+
+
+def test_config_lock_serializes_updates(config_path):
+    """Test that concurrent read-modify-write cycles never lose an update."""
+    write_yggdrasil_config({'Peers': []})
+    
+    def add_peer(i):
+        with config_lock():
             config = read_yggdrasil_config()
-            assert config['Peers'] == ['tcp://peer1:9001']
+            config['Peers'].append(f'tcp://peer{i}:9001')
+            assert write_yggdrasil_config(config) == 'written'
     
-    def test_write_config(self):
-        """Test writing config to file."""
-        test_config = {
-            'Peers': ['tcp://peer1:9001'],
-            'TunnelRouting': {'Enable': False}
-        }
-        
-        with tempfile.NamedTemporaryFile(mode='w', delete=False) as tmp:
-            tmp_path = tmp.name
-        
-        with patch('backend.app.YGGDRASIL_CONFIG', tmp_path):
-            result = write_yggdrasil_config(test_config)
-            assert result is True
-            
-            # Verify file contents
-            with open(tmp_path, 'r') as f:
-                written_config = json.load(f)
-                assert written_config['Peers'] == ['tcp://peer1:9001']
-
-
-class TestAPIEndpoints:
-    """Test Flask API endpoints."""
-    
-    def setup_method(self):
-        """Set up test client."""
-        app.config['TESTING'] = True
-        self.client = app.test_client()
-    
-    def test_api_status(self):
-        """Test /api/status endpoint."""
-        response = self.client.get('/api/status')
-        assert response.status_code == 200
-        
-        data = json.loads(response.data)
-        assert 'status' in data
-        assert 'yggdrasil_socket' in data
-        assert 'backend_version' in data
-    
-    @patch('backend.app.YggdrasilSocket')
-    def test_api_self_success(self, mock_ygg_class):
-        """Test /api/self endpoint with successful response."""
-        mock_ygg = MagicMock()
-        mock_ygg.send_command.return_value = {
-            'address': '200:1234::1',
-            'key': 'testkey123',
-            'coords': '[1 2 3]',
-            'subnet': '300:1234::/64'
-        }
-        mock_ygg_class.return_value = mock_ygg
-        
-        response = self.client.get('/api/self')
-        assert response.status_code == 200
-        
-        data = json.loads(response.data)
-        assert data['address'] == '200:1234::1'
-        assert data['key'] == 'testkey123'
-    
-    @patch('backend.app.YggdrasilSocket')
-    def test_api_self_connection_error(self, mock_ygg_class):
-        """Test /api/self endpoint with connection error."""
-        mock_ygg = MagicMock()
-        mock_ygg.send_command.side_effect = ConnectionError("Socket not found")
-        mock_ygg_class.return_value = mock_ygg
-        
-        response = self.client.get('/api/self')
-        assert response.status_code == 503
-    
-    @patch('backend.app.YggdrasilSocket')
-    @patch('backend.app.qrcode.QRCode')
-    def test_api_invite(self, mock_qr_class, mock_ygg_class):
-        """Test /api/invite endpoint."""
-        # Mock Yggdrasil socket
-        mock_ygg = MagicMock()
-        mock_ygg.send_command.return_value = {
-            'address': '200:1234::1'
-        }
-        mock_ygg_class.return_value = mock_ygg
-        
-        # Mock QR code generation
-        mock_qr = MagicMock()
-        mock_img = MagicMock()
-        mock_qr.make_image.return_value = mock_img
-        mock_qr_class.return_value = mock_qr
-        
-        response = self.client.get('/api/invite')
-        assert response.status_code == 200
-        
-        data = json.loads(response.data)
-        assert 'qr_code' in data
-        assert 'peering_string' in data
-        assert 'tcp://[200:1234::1]:9001' in data['peering_string']
-    
-    @patch('backend.app.requests.get')
-    @patch('backend.app.read_yggdrasil_config')
-    @patch('backend.app.write_yggdrasil_config')
-    @patch('backend.app.reload_yggdrasil')
-    def test_api_bootstrap(self, mock_reload, mock_write, mock_read, mock_requests_get):
-        """Test /api/bootstrap endpoint."""
-        # Mock public peers API
-        mock_response = MagicMock()
-        mock_response.json.return_value = {
-            'United States': [
-                'tcp://peer1.us:9001',
-                'tcp://peer2.us:9001',
-                'tcp://peer3.us:9001'
-            ],
-            'Germany': ['tcp://peer1.de:9001']
-        }
-        mock_requests_get.return_value = mock_response
-        
-        # Mock config
-        mock_read.return_value = {'Peers': []}
-        mock_write.return_value = True
-        mock_reload.return_value = True
-        
-        response = self.client.post('/api/bootstrap')
-        assert response.status_code == 200
-        
-        data = json.loads(response.data)
-        assert data['status'] == 'bootstrapped'
-        assert len(data['peers_added']) <= 3
-    
-    @patch('backend.app.read_yggdrasil_config')
-    @patch('backend.app.write_yggdrasil_config')
-    @patch('backend.app.reload_yggdrasil')
-    def test_api_exit_node_enable(self, mock_reload, mock_write, mock_read):
-        """Test /api/exit-node endpoint (enable)."""
-        # Mock config
-        mock_read.return_value = {
-            'TunnelRouting': {
-                'Enable': False,
-                'IPv6Destinations': []
-            }
+    threads = [threading.Thread(target=add_peer, args=(i,)) for i in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    assert sorted(read_yggdrasil_config()['Peers']) == sorted(f'tcp://peer{i}:9001' for i in range(16))
+
+
+def test_read_config_cached_until_modified(config_path):
+    """Test that the parsed config is reused until the file changes."""
+    write_yggdrasil_config({'Peers': ['tcp://peer1:9001']})
+    
+    config = read_yggdrasil_config()
+    config['Peers'].append('tcp://mutated:9001')
+    assert read_yggdrasil_config()['Peers'] == ['tcp://peer1:9001']
+    
+    write_yggdrasil_config({'Peers': ['tcp://peer2:9001']})
+    assert read_yggdrasil_config()['Peers'] == ['tcp://peer2:9001']
+
+
+# =============================================================================
+# BOOTSTRAP SAMPLING
+# =============================================================================
+
+def test_sample_prefers_regional_peers():
+    """Test that regional peers win and the sample size is respected."""
+    peer_data = {
+        'germany.md': [f'tcp://peer{i}.de:9001' for i in range(20)],
+        'japan.md': ['tcp://peer1.jp:9001']
+    }
+    
+    selected = sample_bootstrap_peers(peer_data, set(), 3)
+    assert len(selected) == 3
+    assert len(set(selected)) == 3
+    assert all(peer.endswith('.de:9001') for peer in selected)
+
+
+def test_sample_falls_back_to_any_region():
+    """Test fallback when no new regional peers are left."""
+    peer_data = {
+        'germany.md': ['tcp://peer1.de:9001'],
+        'japan.md': ['tcp://peer1.jp:9001', {'not': 'a peer'}]
+    }
+    
+    selected = sample_bootstrap_peers(peer_data, {'tcp://peer1.de:9001'}, 3)
+    assert selected == ['tcp://peer1.jp:9001']
+
+
+def test_sample_offers_each_peer_once(monkeypatch):
+    """Test that a duplicate evicted from the sample is not offered again."""
+    peer_data = {'germany.md': ['tcp://a:1', 'tcp://b:1', 'tcp://a:1', 'tcp://c:1', 'tcp://a:1']}
+    # Always replace the current pick, so every offer after the first evicts
+    randint = MagicMock(return_value=0)
+    monkeypatch.setattr(app_module.random, 'randint', randint)
+    
+    assert sample_bootstrap_peers(peer_data, set(), 1) == ['tcp://c:1']
+    assert randint.call_count == 2
+
+
+# =============================================================================
+# RELOAD
+# =============================================================================
+
+def test_reload_sends_sighup(monkeypatch):
+    """Test that SIGHUP goes to the process named yggdrasil."""
+    comms = {'/proc/1/comm': 'init\n', '/proc/42/comm': 'yggdrasil\n'}
+    mock_kill = MagicMock()
+    monkeypatch.setattr(ygg.os, 'listdir', MagicMock(return_value=['self', '1', '42']))
+    monkeypatch.setattr(ygg.os, 'kill', mock_kill)
+    
+    with patch('builtins.open', side_effect=lambda path: io.StringIO(comms[path])):
+        assert reload_yggdrasil() is True
+    mock_kill.assert_called_once_with(42, signal.SIGHUP)
+
+
+def test_reload_process_not_found(monkeypatch):
+    """Test reload when Yggdrasil is not running."""
+    mock_kill = MagicMock()
+    monkeypatch.setattr(ygg.os, 'listdir', MagicMock(return_value=['1']))
+    monkeypatch.setattr(ygg.os, 'kill', mock_kill)
+    
+    with patch('builtins.open', side_effect=PermissionError):
+        assert reload_yggdrasil() is False
+    mock_kill.assert_not_called()
+
+
+# =============================================================================
+# API ENDPOINTS
+# =============================================================================
+
+def test_api_status(client):
+    """Test /api/status endpoint."""
+    response = client.get('/api/status')
+    assert response.status_code == 200
+    
+    data = response.get_json()
+    assert 'status' in data
+    assert 'yggdrasil_socket' in data
+    assert 'backend_version' in data
+
+
+def test_api_self_success(client, mock_ygg, self_response):
+    """Test /api/self endpoint with successful response."""
+    mock_ygg.send_command.return_value = self_response
+    
+    response = client.get('/api/self')
+    assert response.status_code == 200
+    
+    data = response.get_json()
+    assert data['address'] == '200:1234::1'
+    assert data['key'] == 'testkey123'
+
+
+def test_api_peers(client, mock_ygg):
+    """Test /api/peers endpoint."""
+    mock_ygg.send_command.return_value = {
+        'peers': [{'address': '200:abcd::1', 'port': 1, 'uptime': 60}]
+    }
+    
+    response = client.get('/api/peers')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/json'
+    
+    data = response.get_json()
+    assert data['peers'][0]['address'] == '200:abcd::1'
+
+
+def test_api_summary(client, mock_ygg):
+    """Test /api/summary endpoint batches getSelf and getPeers."""
+    mock_ygg.send_batch.return_value = [
+        {'address': '200:1234::1', 'key': 'testkey123'},
+        {'peers': [{'address': '200:abcd::1'}]}
+    ]
+    
+    response = client.get('/api/summary')
+    assert response.status_code == 200
+    
+    data = response.get_json()
+    assert data['self']['address'] == '200:1234::1'
+    assert data['self']['subnet'] == 'N/A'
+    assert data['peers'] == [{'address': '200:abcd::1'}]
+    mock_ygg.send_batch.assert_called_once_with(['getSelf', 'getPeers'])
+
+
+def test_api_summary_server_closes_after_reply(client, mock_socket_class, self_response):
+    """Test /api/summary against a daemon that closes after every reply."""
+    peers = [{'address': '200:abcd::1'}]
+    connections = _fake_connections(
+        mock_socket_class,
+        honour_keepalive=False,
+        results={'getSelf': self_response, 'getPeers': {'peers': peers}}
+    )
+    
+    with patch('os.path.exists', return_value=True):
+        response = client.get('/api/summary')
+    assert response.status_code == 200
+    
+    data = response.get_json()
+    assert data['self']['address'] == '200:1234::1'
+    assert data['peers'] == peers
+    assert len(connections) == 2
+
+
+def test_api_self_connection_error(client, mock_ygg):
+    """Test /api/self endpoint with connection error."""
+    mock_ygg.send_command.side_effect = ConnectionError("Socket not found")
+    
+    response = client.get('/api/self')
+    assert response.status_code == 503
+
+
+def test_api_self_cached(client, mock_ygg, self_response):
+    """Test that repeated /api/self calls reuse the cached RPC result."""
+    mock_ygg.send_command.return_value = self_response
+    
+    assert client.get('/api/self').status_code == 200
+    assert client.get('/api/self').status_code == 200
+    assert mock_ygg.send_command.call_count == 1
+
+
+def test_api_invite(client, mock_ygg, mock_qr_make, self_response):
+    """Test /api/invite endpoint."""
+    # Mock Yggdrasil socket
+    mock_ygg.send_command.return_value = self_response
+    
+    response = client.get('/api/invite')
+    assert response.status_code == 200
+    
+    data = response.get_json()
+    assert 'qr_code' in data
+    assert data['peering_string'] == EXPECTED_PEER
+
+
+def test_api_invite_cached(client, mock_ygg, mock_qr_make, self_response):
+    """Test that the invite QR code is rendered once per address."""
+    mock_ygg.send_command.return_value = self_response
+    
+    first = client.get('/api/invite')
+    second = client.get('/api/invite')
+    assert first.status_code == second.status_code == 200
+    assert mock_qr_make.call_count == 1
+
+
+def test_api_bootstrap(client, ygg_mocks):
+    """Test /api/bootstrap endpoint."""
+    # Mock public peers API
+    ygg_mocks.requests_get.return_value = FakePeersResponse({
+        'United States': [
+            'tcp://peer1.us:9001',
+            'tcp://peer2.us:9001',
+            'tcp://peer3.us:9001'
+        ],
+        'Germany': ['tcp://peer1.de:9001']
+    })
+    
+    # Mock config
+    ygg_mocks.read.return_value = {'Peers': []}
+    
+    response = client.post('/api/bootstrap')
+    assert response.status_code == 200
+    
+    data = response.get_json()
+    assert data['status'] == 'bootstrapped'
+    assert len(data['peers_added']) <= 3
+    
+    # A second bootstrap reuses the cached public peer list
+    assert client.post('/api/bootstrap').status_code == 200
+    assert ygg_mocks.requests_get.call_count == 1
+
+
+def test_api_bootstrap_regions(client, ygg_mocks):
+    """Test region matching, skipping existing peers and deduplication."""
+    ygg_mocks.requests_get.return_value = FakePeersResponse({
+        'russia.md': ['tcp://peer1.ru:9001', 'tcp://peer2.ru:9001'],
+        'united-states.md': ['tcp://peer1.us:9001'],
+        'Germany': ['tcp://peer1.de:9001']
+    })
+    
+    ygg_mocks.read.return_value = {'Peers': ['tcp://peer1.de:9001', 'tcp://peer1.de:9001']}
+    
+    response = client.post('/api/bootstrap')
+    assert response.status_code == 200
+    
+    data = response.get_json()
+    assert data['peers_added'] == ['tcp://peer1.us:9001']
+    
+    # Duplicates already in the config are collapsed on write
+    written_config = ygg_mocks.write.call_args[0][0]
+    assert written_config['Peers'] == ['tcp://peer1.de:9001', 'tcp://peer1.us:9001']
+    assert data['total_peers'] == 2
+
+
+def test_api_bootstrap_no_usable_peers(client, ygg_mocks):
+    """Test that a peer list without usable entries leaves the config alone."""
+    ygg_mocks.requests_get.return_value = FakePeersResponse({
+        'Germany': [{'not': 'a peer'}, 42]
+    })
+    ygg_mocks.read.return_value = {'Peers': []}
+    
+    response = client.post('/api/bootstrap')
+    assert response.status_code == 500
+    assert response.get_json()['error'] == 'No public peers available'
+    ygg_mocks.write.assert_not_called()
+
+
+def _config_lock_held():
+    """Check whether anyone (thread or process) holds the config lock."""
+    with open(ygg.YGGDRASIL_CONFIG + '.lock', 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        return False
+
+
+def test_config_writes_hold_config_lock(client, ygg_mocks):
+    """Test that bootstrap and exit-node read and write the config under the lock."""
+    ygg_mocks.requests_get.return_value = FakePeersResponse({
+        'United States': ['tcp://peer1.us:9001']
+    })
+    ygg_mocks.read.side_effect = lambda: (
+        {'Peers': []} if _config_lock_held() else pytest.fail('read without lock'))
+    ygg_mocks.write.side_effect = lambda config: (
+        'written' if _config_lock_held() else pytest.fail('write without lock'))
+    
+    assert client.post('/api/bootstrap').status_code == 200
+    assert client.post('/api/exit-node', json={'enabled': True}).status_code == 200
+    assert ygg_mocks.write.call_count == 2
+    assert not _config_lock_held()
+
+
+@pytest.mark.parametrize('enabled,initial_enable,initial_dests,expect_route', [
+    (True, False, [], True),
+    (False, True, ['::/0'], False),
+], ids=['enable', 'disable'])
+def test_api_exit_node(client, ygg_mocks, enabled, initial_enable, initial_dests,
+                       expect_route):
+    """Test /api/exit-node endpoint (enable and disable)."""
+    ygg_mocks.read.return_value = {
+        'TunnelRouting': {
+            'Enable': initial_enable,
+            'IPv6Destinations': list(initial_dests)
         }
-        mock_write.return_value = True
-        mock_reload.return_value = True
-        
-        response = self.client.post('/api/exit-node', 
-                                   json={'enabled': True})
-        assert response.status_code == 200
-        
-        data = json.loads(response.data)
-        assert data['enabled'] is True
-        assert '::/0' in data['advertised_routes']
-    
-    @patch('backend.app.read_yggdrasil_config')
-    @patch('backend.app.write_yggdrasil_config')
-    @patch('backend.app.reload_yggdrasil')
-    def test_api_exit_node_disable(self, mock_reload, mock_write, mock_read):
-        """Test /api/exit-node endpoint (disable)."""
-        # Mock config with exit node enabled
-        mock_read.return_value = {
-            'TunnelRouting': {
-                'Enable': True,
-                'IPv6Destinations': ['::/0']
-            }
+    }
+    
+    response = client.post('/api/exit-node', json={'enabled': enabled})
+    assert response.status_code == 200
+    
+    data = response.get_json()
+    assert data['enabled'] is enabled
+    assert ('::/0' in data['advertised_routes']) is expect_route
+
+
+def test_api_exit_node_unchanged(client, ygg_mocks):
+    """Test that a no-op toggle does not reload Yggdrasil."""
+    ygg_mocks.read.return_value = {
+        'TunnelRouting': {
+            'Enable': True,
+            'IPv6Destinations': ['::/0']
         }
-        mock_write.return_value = True
-        mock_reload.return_value = True
-        
-        response = self.client.post('/api/exit-node',
-                                   json={'enabled': False})
-        assert response.status_code == 200
-        
-        data = json.loads(response.data)
-        assert data['enabled'] is False
-        assert '::/0' not in data['advertised_routes']
+    }
+    ygg_mocks.write.return_value = 'unchanged'
+    
+    response = client.post('/api/exit-node', json={'enabled': True})
+    assert response.status_code == 200
+    
+    data = response.get_json()
+    assert data['reload_success'] is True
+    ygg_mocks.reload.assert_not_called()
 
 
-if __name__ == '__main__':
-    # Run tests manually without pytest
-    import sys
+def test_serve_frontend(client, monkeypatch, tmp_path):
+    """Test static file serving, page routes and the index.html fallback."""
+    (tmp_path / '_next' / 'static').mkdir(parents=True)
+    (tmp_path / '_next' / 'static' / 'app-abc123.js').write_text('console.log(1)')
+    (tmp_path / 'index.html').write_text('<html>home</html>')
+    (tmp_path / 'peers.html').write_text('<html>peers</html>')
     
-    print("🧪 Running Yggdrasil Commander Backend Tests\n")
+    monkeypatch.setattr(app_module, '_static_index', build_static_index(tmp_path))
+    response = client.get('/_next/static/app-abc123.js')
+    assert response.status_code == 200
+    assert response.mimetype in ('text/javascript', 'application/javascript')
+    assert response.cache_control.immutable
     
-    test_classes = [TestYggdrasilSocket, TestConfigManagement, TestAPIEndpoints]
+    response = client.get('/peers')
+    assert response.data == b'<html>peers</html>'
+    assert not response.cache_control.immutable
+    assert response.cache_control.no_cache
+    assert response.last_modified is not None
     
-    total_tests = 0
-    passed_tests = 0
+    # Revalidation with the ETag gets an empty 304
+    etag = response.get_etag()[0]
+    response = client.get('/peers', headers={'If-None-Match': f'"{etag}"'})
+    assert response.status_code == 304
+    assert response.data == b''
     
-    for test_class in test_classes:
-        print(f"\n📋 {test_class.__name__}")
-        print("=" * 60)
-        
-        instance = test_class()
-        if hasattr(instance, 'setup_method'):
-            instance.setup_method()
-        
-        # Get all test methods
-        test_methods = [m for m in dir(instance) if m.startswith('test_')]
-        
-        for method_name in test_methods:
-            total_tests += 1
-            try:
-                method = getattr(instance, method_name)
-                method()
-                print(f"  ✅ {method_name}")
-                passed_tests += 1
-            except Exception as e:
-                print(f"  ❌ {method_name}: {str(e)}")
-    
-    print("\n" + "=" * 60)
-    print(f"📊 Results: {passed_tests}/{total_tests} tests passed")
-    
-    sys.exit(0 if passed_tests == total_tests else 1)
+    response = client.get('/', headers={'Range': 'bytes=0-5'})
+    assert response.status_code == 206
+    assert response.data == b'<html>'
+    
+    response = client.get('/unknown/route')
+    assert response.data == b'<html>home</html>'
+
+
+if __name__ == '__main__':
+    # `python test_app.py` is shorthand for running pytest on this file
+    sys.exit(pytest.main([__file__, '-v'] + sys.argv[1:]))
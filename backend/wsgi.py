@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+"""
+Yggdrasil Commander - WSGI entry point
+Production servers load the Flask app from here.
+
+Run with: gunicorn -k gthread -w 2 --threads 8 -b 0.0.0.0:5000 wsgi:app
+"""
+
+from app import app
@@ -0,0 +1,650 @@
+"""
+Yggdrasil Commander - Yggdrasil daemon access.
+Admin socket client and configuration file handling, independent of Flask.
+"""
+
+import os
+import re
+import copy
+import mmap
+import fcntl
+import atexit
+import json
+import time
+import signal
+import socket
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+# Fast JSON: prefer orjson, then ujson, then the standard library.
+# json_loads accepts str, bytes or memoryview; json_dumps always returns bytes.
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_dumps(obj, indent=False):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+
+except ImportError:
+    try:
+        import ujson as _json
+    except ImportError:
+        _json = json
+
+    def json_loads(data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return _json.loads(data)
+
+    def json_dumps(obj, indent=False):
+        # ujson rejects indent=None, so only pass indent when it is wanted
+        data = _json.dumps(obj, indent=2) if indent else _json.dumps(obj)
+        return data.encode('utf-8')
+
+# Configuration
+YGGDRASIL_SOCKET = os.environ.get('YGGDRASIL_SOCKET', '/var/run/yggdrasil/yggdrasil.sock')
+YGGDRASIL_CONFIG = '/etc/yggdrasil/yggdrasil.conf'
+
+
+# =============================================================================
+# CACHING
+# =============================================================================
+
+_LEADING_WHITESPACE_RE = re.compile(rb'\s*')
+
+# key -> (value, expiry) for short-lived socket RPC results
+_cache = {}
+# config path -> ((st_mtime_ns, st_size), parsed config)
+_config_cache = {}
+_cache_lock = threading.Lock()
+
+
+def cached(key, ttl, fn):
+    """
+    Return the result of fn(), reusing it for up to ttl seconds.
+    
+    Exceptions are not cached, so a failed call is retried on the next request.
+    
+    Args:
+        key (str): Cache key
+        ttl (float): Time to live in seconds
+        fn (callable): Zero-argument function producing the value
+    
+    Returns:
+        The cached or freshly computed value
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+    
+    value = fn()
+    with _cache_lock:
+        _cache[key] = (value, now + ttl)
+    return value
+
+
+def clear_cache():
+    """Drop all cached socket results and parsed configs."""
+    with _cache_lock:
+        _cache.clear()
+        _config_cache.clear()
+
+
+class _ConnectionClosed(ConnectionResetError):
+    """Yggdrasil closed the connection before every response arrived."""
+    
+    def __init__(self, responses):
+        super().__init__("Connection closed by Yggdrasil")
+        # Complete responses received before the connection closed
+        self.responses = responses
+
+
+class YggdrasilSocket:
+    """
+    Helper class for communicating with Yggdrasil admin socket via JSON-RPC.
+    
+    Connections are opened lazily and kept open per thread and socket path,
+    so consecutive requests handled by the same worker thread reuse a single
+    connection instead of reconnecting every time.
+    """
+    
+    SOCKET_TIMEOUT = 5  # seconds
+    SOCKET_BUFFER_SIZE = 4 * 1024 * 1024
+    RECV_SIZE = 65536
+    
+    # Per-thread {socket_path: socket} of persistent connections
+    _local = threading.local()
+    # Every open persistent connection, so they can be closed at exit
+    _open_sockets = set()
+    _open_sockets_lock = threading.Lock()
+    
+    def __init__(self, socket_path=YGGDRASIL_SOCKET):
+        self.socket_path = socket_path
+    
+    def _connections(self):
+        """Return this thread's {socket_path: socket} mapping."""
+        conns = getattr(self._local, 'conns', None)
+        if conns is None:
+            conns = self._local.conns = {}
+        return conns
+    
+    def _connect(self):
+        """
+        Get a connected socket for this thread, opening one if needed.
+        
+        Returns:
+            tuple: (socket, reused) where reused is True for an existing connection
+        """
+        conns = self._connections()
+        sock = conns.get(self.socket_path)
+        if sock is not None:
+            return sock, True
+        
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.SOCKET_BUFFER_SIZE)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.SOCKET_BUFFER_SIZE)
+            sock.settimeout(self.SOCKET_TIMEOUT)
+            sock.connect(self.socket_path)
+        except Exception:
+            sock.close()
+            raise
+        
+        conns[self.socket_path] = sock
+        with self._open_sockets_lock:
+            self._open_sockets.add(sock)
+        return sock, False
+    
+    def _disconnect(self):
+        """Close and forget this thread's connection to the socket."""
+        sock = self._connections().pop(self.socket_path, None)
+        if sock is None:
+            return
+        with self._open_sockets_lock:
+            self._open_sockets.discard(sock)
+        try:
+            sock.close()
+        except OSError:
+            pass
+    
+    @classmethod
+    def close_all(cls):
+        """Close every persistent connection opened by any thread."""
+        with cls._open_sockets_lock:
+            sockets = list(cls._open_sockets)
+            cls._open_sockets.clear()
+        for sock in sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        cls._local.conns = {}
+    
+    def _exchange(self, requests_json):
+        """
+        Send encoded requests and read back the decoded responses.
+        
+        All requests go out in one write. A reused connection may have been
+        closed by Yggdrasil since its last use; in that case the requests are
+        retried once on a fresh connection. If Yggdrasil closes the
+        connection after answering only some of a pipelined batch, the rest
+        are sent one at a time.
+        
+        Args:
+            requests_json (list): Encoded requests, without newlines
+        
+        Returns:
+            list: The decoded response documents, one per request
+        """
+        responses = []
+        step = len(requests_json)
+        retried = False
+        while len(responses) < len(requests_json):
+            pending = requests_json[len(responses):len(responses) + step]
+            # Yggdrasil expects newline-terminated requests; join all frames
+            # into one buffer so they go out in one sendall()
+            payload = b''.join(part for frame in pending for part in (frame, b'\n'))
+            
+            sock, reused = self._connect()
+            try:
+                responses += self._exchange_on(sock, payload, len(pending))
+                retried = False
+            except socket.timeout:
+                self._disconnect()
+                raise
+            except OSError as e:
+                self._disconnect()
+                partial = getattr(e, 'responses', None)
+                if partial:
+                    responses += partial
+                    step = 1
+                    retried = False
+                    continue
+                if not reused or retried:
+                    raise
+                retried = True
+        
+        return responses
+    
+    def _exchange_on(self, sock, payload, count):
+        """Write payload to sock and read back count decoded JSON responses."""
+        sock.sendall(payload)
+        
+        # Only requests are newline-terminated; a response may span several
+        # (indented) lines. Each response is parsed once, as soon as its
+        # closing line has arrived (see _next_document).
+        response_data = bytearray()
+        responses = []
+        start = scanned = 0
+        while True:
+            chunk = sock.recv(self.RECV_SIZE)
+            closed = not chunk
+            if closed:
+                # Connection closed by Yggdrasil; it cannot be reused. The
+                # last response may lack its trailing newline.
+                self._disconnect()
+                chunk = b'\n'
+            
+            response_data += chunk
+            while len(responses) < count:
+                end, document = self._next_document(response_data, start, scanned)
+                if end is None:
+                    break
+                responses.append(document)
+                start = scanned = end
+            
+            if len(responses) == count:
+                return responses
+            if closed:
+                raise _ConnectionClosed(responses)
+            scanned = len(response_data)
+    
+    @staticmethod
+    def _next_document(data, start, scanned):
+        """
+        Parse the JSON document at the start of data[start:], if it is complete.
+        
+        Yggdrasil writes each response either on a single line, or indented
+        with the closing bracket at the indentation the document opened at.
+        JSON strings cannot contain raw newlines, so only such a line can end
+        the document; the parser runs only there, not on every chunk.
+        
+        Args:
+            data (bytearray): Bytes received so far
+            start (int): Offset of the document (leading whitespace is skipped)
+            scanned (int): Offset up to which data was already searched for
+                the end of this document
+        
+        Returns:
+            tuple: (end offset, decoded document), or (None, None) if the
+            document has not fully arrived yet
+        """
+        start = _LEADING_WHITESPACE_RE.match(data, start).end()
+        if start == len(data):
+            return None, None
+        
+        # Single-line document: complete once its line is
+        if scanned <= start or data.find(b'\n', start, scanned) == -1:
+            newline = data.find(b'\n', max(start, scanned))
+            if newline != -1:
+                end = newline
+                while data[end - 1] in b' \t\r':
+                    end -= 1
+                if data[end - 1] in b'}]':
+                    try:
+                        with memoryview(data)[start:end] as document:
+                            return end, json_loads(document)
+                    except ValueError:
+                        pass
+        
+        # Indented document: ends at a closing bracket at its own indentation
+        indent = bytes(data[data.rfind(b'\n', 0, start) + 1:start])
+        closing = re.compile(rb'\n' + re.escape(indent) + rb'[}\]]')
+        for match in closing.finditer(data, max(start, scanned - len(indent) - 1)):
+            try:
+                with memoryview(data)[start:match.end()] as document:
+                    return match.end(), json_loads(document)
+            except ValueError:
+                continue
+        
+        return None, None
+    
+    def probe(self, timeout=0.2):
+        """
+        Check whether Yggdrasil accepts connections on the admin socket.
+        
+        Only connects and disconnects; no request is sent, so this is much
+        cheaper than a full RPC round-trip.
+        
+        Args:
+            timeout (float): Connect timeout in seconds
+        
+        Returns:
+            bool: True if the connection succeeded, False otherwise
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(self.socket_path)
+            return True
+        except OSError:
+            return False
+        finally:
+            sock.close()
+    
+    @staticmethod
+    def _encode_request(method, params=None, request_id=1):
+        """
+        Serialize one JSON-RPC request (without the trailing newline).
+        
+        Requests ask Yggdrasil to keep the connection open; without the
+        keepalive flag it closes the admin connection after each reply and
+        the persistent connection would be dead on its next use.
+        """
+        request_obj = {
+            "jsonrpc": "2.0",
+            "id": request_id,
+            "method": method,
+            "keepalive": True
+        }
+        if params:
+            request_obj["params"] = params
+        
+        return json_dumps(request_obj)
+    
+    @staticmethod
+    def _parse_response(response):
+        """Check a decoded JSON-RPC response and return its result."""
+        try:
+            # Check for JSON-RPC errors
+            if 'error' in response:
+                raise ValueError(f"RPC Error: {response['error']}")
+            
+            return response.get('result', response)
+        
+        except Exception as e:
+            raise RuntimeError(f"Unexpected error: {e}")
+    
+    def _request(self, requests_json):
+        """Send encoded requests and return the decoded responses."""
+        if not os.path.exists(self.socket_path):
+            raise ConnectionError(f"Yggdrasil socket not found at {self.socket_path}")
+        
+        try:
+            return self._exchange(requests_json)
+        
+        except socket.timeout:
+            raise ConnectionError(f"Timeout connecting to {self.socket_path}")
+        except socket.error as e:
+            raise ConnectionError(f"Socket error: {e}")
+        except Exception as e:
+            raise RuntimeError(f"Unexpected error: {e}")
+    
+    def send_command(self, method, params=None):
+        """
+        Send a JSON-RPC request to the Yggdrasil admin socket.
+        
+        Args:
+            method (str): The RPC method to call (e.g., 'getSelf', 'getPeers')
+            params (dict): Optional parameters for the method
+        
+        Returns:
+            dict: The JSON-RPC response
+        
+        Raises:
+            ConnectionError: If unable to connect to the socket
+            ValueError: If the response is invalid JSON
+        """
+        return self._parse_response(self._request([self._encode_request(method, params)])[0])
+    
+    def send_batch(self, commands):
+        """
+        Pipeline several JSON-RPC requests over one connection.
+        
+        All requests are written at once and the responses are read back in
+        order, saving a round-trip per additional command. If Yggdrasil
+        closes the connection part-way through, the remaining commands are
+        sent one at a time.
+        
+        Args:
+            commands (list): Method names, or (method, params) tuples
+        
+        Returns:
+            list: One result per command, as returned by send_command
+        
+        Raises:
+            ConnectionError: If unable to connect to the socket
+        """
+        requests_json = []
+        for request_id, command in enumerate(commands, start=1):
+            method, params = (command, None) if isinstance(command, str) else command
+            requests_json.append(self._encode_request(method, params, request_id))
+        
+        return [self._parse_response(response) for response in self._request(requests_json)]
+
+
+atexit.register(YggdrasilSocket.close_all)
+
+
+def check_yggdrasil_socket():
+    """Check if the Yggdrasil admin socket is accessible."""
+    try:
+        return os.path.exists(YGGDRASIL_SOCKET)
+    except Exception:
+        return False
+
+
+def reload_yggdrasil():
+    """
+    Reload Yggdrasil configuration by sending SIGHUP to the process.
+    
+    The process is found by scanning /proc/<pid>/comm directly rather than
+    spawning pidof/ps.
+    
+    Returns:
+        bool: True if successful, False otherwise
+    """
+    try:
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open(f'/proc/{entry}/comm') as f:
+                    if f.read().strip() != 'yggdrasil':
+                        continue
+            except OSError:
+                # Process exited or is not readable
+                continue
+            
+            os.kill(int(entry), signal.SIGHUP)
+            return True
+        
+        return False
+    
+    except Exception as e:
+        print(f"Error reloading Yggdrasil: {e}")
+        return False
+
+
+def read_yggdrasil_config():
+    """
+    Read Yggdrasil configuration file.
+    
+    The parsed config is cached until the file's mtime or size changes.
+    Callers get a private copy they are free to modify.
+    
+    Returns:
+        dict: Configuration object
+    """
+    try:
+        st = os.stat(YGGDRASIL_CONFIG)
+        stat_key = (st.st_mtime_ns, st.st_size)
+    except OSError:
+        stat_key = None
+    
+    if stat_key is not None:
+        with _cache_lock:
+            entry = _config_cache.get(YGGDRASIL_CONFIG)
+        if entry is not None and entry[0] == stat_key:
+            return copy.deepcopy(entry[1])
+    
+    config = _load_yggdrasil_config()
+    
+    if stat_key is not None:
+        with _cache_lock:
+            _config_cache[YGGDRASIL_CONFIG] = (stat_key, copy.deepcopy(config))
+    
+    return config
+
+
+def _load_yggdrasil_config():
+    """Read and parse the configuration file, bypassing the cache."""
+    try:
+        fd = os.open(YGGDRASIL_CONFIG, os.O_RDONLY)
+    
+    except FileNotFoundError:
+        # Create mock config for testing/development
+        return {
+            'Peers': [],
+            'TunnelRouting': {
+                'Enable': False,
+                'IPv6Sources': [],
+                'IPv6Destinations': [],
+                'IPv4Sources': [],
+                'IPv4Destinations': []
+            }
+        }
+    
+    try:
+        size = os.fstat(fd).st_size
+        if size == 0:
+            # mmap can't map an empty file
+            return parse_yggdrasil_config(b'')
+        
+        # Parse straight from the page cache instead of copying the file
+        # into a Python string first
+        with mmap.mmap(fd, size, access=mmap.ACCESS_READ) as mm:
+            return parse_yggdrasil_config(mm)
+    
+    finally:
+        os.close(fd)
+
+
+def parse_yggdrasil_config(content):
+    """
+    Parse the contents of a Yggdrasil configuration file.
+    
+    The format is chosen from the first non-whitespace character instead of
+    trying each parser in turn: '{' means JSON, anything else is TOML.
+    
+    Args:
+        content (bytes): File contents (any bytes-like object, e.g. an mmap)
+    
+    Returns:
+        dict: Configuration object
+    
+    Raises:
+        ValueError: If the content cannot be parsed
+    """
+    start = _LEADING_WHITESPACE_RE.match(content).end()
+    
+    try:
+        if content[start:start + 1] == b'{':
+            with memoryview(content) as view:
+                return json_loads(view)
+        return tomllib.loads(bytes(content).decode('utf-8'))
+    
+    except ValueError as e:
+        # Never fall back to an empty config here: writing it back would
+        # silently wipe the user's settings
+        print(f"Error parsing config {YGGDRASIL_CONFIG}: {e}")
+        raise ValueError(f"Invalid configuration file: {e}") from e
+
+
+def write_yggdrasil_config(config):
+    """
+    Write Yggdrasil configuration file.
+    
+    The file is left untouched if it already holds exactly this config.
+    Otherwise it is written to a uniquely named temporary file and atomically
+    renamed into place, so neither a crash nor a concurrent write leaves a
+    half-written config behind.
+    
+    Args:
+        config (dict): Configuration object
+    
+    Returns:
+        str or bool: 'written' if the file was updated, 'unchanged' if it
+        already matched, False on error
+    """
+    try:
+        # Write as JSON (Yggdrasil accepts JSON)
+        data = json_dumps(config, indent=True)
+        
+        # Skip the write (and the caller's reload) if nothing changed
+        try:
+            with open(YGGDRASIL_CONFIG, 'rb') as f:
+                if f.read() == data:
+                    return 'unchanged'
+            # Keep the original permissions; the config holds the private key
+            mode = os.stat(YGGDRASIL_CONFIG).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o600
+        
+        # Ensure parent directory exists
+        os.makedirs(os.path.dirname(YGGDRASIL_CONFIG), exist_ok=True)
+        
+        # A unique temp file per call, so concurrent writers never share one
+        config_dir, config_name = os.path.split(YGGDRASIL_CONFIG)
+        fd, tmp_path = tempfile.mkstemp(dir=config_dir, prefix='.' + config_name + '.')
+        try:
+            os.fchmod(fd, mode)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, YGGDRASIL_CONFIG)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+        
+        # Write-through: force the next read to re-parse the new file
+        with _cache_lock:
+            _config_cache.pop(YGGDRASIL_CONFIG, None)
+        
+        return 'written'
+    
+    except Exception as e:
+        print(f"Error writing config: {e}")
+        return False
+
+
+@contextmanager
+def config_lock():
+    """
+    Hold an exclusive lock on the config for a read-modify-write.
+    
+    The lock is an flock on yggdrasil.conf.lock next to the config. Every
+    call opens the lock file itself, so it serializes request threads and
+    separate gunicorn worker processes alike.
+    """
+    os.makedirs(os.path.dirname(YGGDRASIL_CONFIG), exist_ok=True)
+    fd = os.open(YGGDRASIL_CONFIG + '.lock', os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        # Closing the file releases the lock
+        os.close(fd)
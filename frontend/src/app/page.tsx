@@ -14,7 +14,7 @@ import {
 import StatusCard from '@/components/StatusCard';
 import Wizard from '@/components/Wizard';
 import InviteModal from '@/components/InviteModal';
-import { getStatus, getNodeInfo, getPeers, type NodeInfo, type Peer } from '@/lib/api';
+import { getStatus, getSummary, type NodeInfo, type Peer } from '@/lib/api';
 
 export default function DashboardPage() {
   // State
@@ -32,21 +32,18 @@ export default function DashboardPage() {
 
     const fetchData = async () => {
       try {
-        // Fetch node info and peers in parallel
-        const [nodeData, peersData] = await Promise.all([
-          getNodeInfo(),
-          getPeers(),
-        ]);
+        // Fetch node info and peers in one request
+        const summary = await getSummary();
 
         if (!cancelled) {
-          setNodeInfo(nodeData);
-          setPeers(peersData.peers);
+          setNodeInfo(summary.self);
+          setPeers(summary.peers);
           setError(null);
           setIsLoading(false);
           setLastUpdate(new Date());
 
           // Show wizard if no peers connected
-          if (peersData.peers.length === 0 && !showWizard) {
+          if (summary.peers.length === 0 && !showWizard) {
             setShowWizard(true);
           }
         }
@@ -36,6 +36,12 @@ export interface PeersResponse {
   peers: Peer[];
 }
 
+export interface SummaryResponse {
+  self: NodeInfo;
+  peers: Peer[];
+  socket_responsive: boolean;
+}
+
 export interface InviteResponse {
   qr_code: string; // Base64 data URI
   peering_string: string;
@@ -126,6 +132,13 @@ export async function getPeers(): Promise<PeersResponse> {
   return fetchAPI<PeersResponse>('/peers');
 }
 
+/**
+ * Get node information and peers in a single request (dashboard polling)
+ */
+export async function getSummary(): Promise<SummaryResponse> {
+  return fetchAPI<SummaryResponse>('/summary');
+}
+
 /**
  * Generate invite QR code for peering
  */